@@ -1,5 +1,12 @@
 from PIL import Image
+import io
 import os
+import copy
+import shutil
+import struct
+import tarfile
+import tempfile
+import zipfile
 from typing import Tuple, Optional
 import exifread
 import piexif
@@ -14,6 +21,35 @@ except ImportError:
 except Exception as e:
     print(f"Failed to register HEIF opener: {e}")
 
+# 归档模式中需要写入GPS信息的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.heic', '.heif', '.avif')
+
+# 归档成员流式复制时的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# 按zipfile.structFileHeader解包本地文件头后，文件名长度和扩展字段长度的位置
+ZIP_LOCAL_HEADER_NAME_LENGTH = 10
+ZIP_LOCAL_HEADER_EXTRA_LENGTH = 11
+
+# ZIP通用标志位中的加密位和数据描述符位
+ZIP_FLAG_ENCRYPTED = 0x1
+ZIP_FLAG_DATA_DESCRIPTOR = 0x8
+
+# ZIP数据描述符签名和ZIP64扩展字段ID
+ZIP_DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+
+# TAR归档扩展名与流式写入模式的对应关系
+TAR_WRITE_MODES = (
+    ('.tar.gz', 'w|gz'),
+    ('.tgz', 'w|gz'),
+    ('.tar.bz2', 'w|bz2'),
+    ('.tbz2', 'w|bz2'),
+    ('.tar.xz', 'w|xz'),
+    ('.txz', 'w|xz'),
+    ('.tar', 'w|'),
+)
+
 class GeoProcessor:
     """处理图片GPS信息的核心类"""
     
@@ -376,3 +412,299 @@ class GeoProcessor:
             import traceback
             traceback.print_exc()
             return False
+    
+    @staticmethod
+    def supports_piexif_insert(data: bytes) -> bool:
+        """判断图片数据是否为piexif.insert支持的JPEG或WebP格式"""
+        if data[:2] == b'\xff\xd8':
+            return True
+        return data[:4] == b'RIFF' and data[8:12] == b'WEBP'
+    
+    @staticmethod
+    def webp_has_exif(data: bytes) -> bool:
+        """遍历WebP的RIFF块，判断是否包含EXIF块"""
+        pos = 12
+        while pos + 8 <= len(data):
+            chunk_id = data[pos:pos + 4]
+            chunk_size = struct.unpack('<L', data[pos + 4:pos + 8])[0]
+            if chunk_id == b'EXIF':
+                return True
+            # RIFF块按偶数字节对齐
+            pos += 8 + chunk_size + (chunk_size & 1)
+        return False
+    
+    @staticmethod
+    def add_gps_to_bytes(data: bytes, lat: float, lon: float) -> Optional[bytes]:
+        """在内存中向图片数据添加GPS信息，返回新的图片数据，失败返回None"""
+        try:
+            lat = float(lat)
+            lon = float(lon)
+            
+            # JPEG和WebP优先使用piexif直接插入EXIF，避免重新编码图片
+            # 其他格式piexif.load会把数据当作文件路径处理，直接使用PIL
+            if GeoProcessor.supports_piexif_insert(data):
+                try:
+                    if data[:2] != b'\xff\xd8' and not GeoProcessor.webp_has_exif(data):
+                        # 不含EXIF块的WebP无法被piexif.load解析，从空的EXIF开始
+                        exif_dict = {}
+                    else:
+                        exif_dict = piexif.load(data)
+                    exif_dict['GPS'] = GeoProcessor.create_gps_exif_dict(lat, lon)
+                    exif_bytes = piexif.dump(exif_dict)
+                    output = io.BytesIO()
+                    piexif.insert(exif_bytes, data, output)
+                    return output.getvalue()
+                except Exception as piexif_error:
+                    print(f"Failed to use piexif.insert, falling back to PIL save: {piexif_error}")
+            
+            # 回退到PIL重新保存，使用原始格式和最高质量
+            with Image.open(io.BytesIO(data)) as image:
+                save_format = image.format or 'PNG'
+                image_with_gps = GeoProcessor.add_gps_to_image(image, lat, lon)
+                save_kwargs = {}
+                if 'exif' in image_with_gps.info:
+                    save_kwargs['exif'] = image_with_gps.info['exif']
+                if save_format not in ['PNG', 'BMP', 'TIFF']:
+                    save_kwargs['quality'] = 100
+                output = io.BytesIO()
+                image_with_gps.save(output, format=save_format, **save_kwargs)
+                return output.getvalue()
+        except Exception as e:
+            print(f"Failed to add GPS to image data: {e}")
+            return None
+    
+    @staticmethod
+    def is_image_member(name: str) -> bool:
+        """判断归档成员是否为需要写入GPS信息的图片"""
+        return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    
+    @staticmethod
+    def get_tar_write_mode(archive_path: str) -> Optional[str]:
+        """根据扩展名获取TAR归档的流式写入模式，非TAR归档返回None"""
+        lower_path = archive_path.lower()
+        for ext, mode in TAR_WRITE_MODES:
+            if lower_path.endswith(ext):
+                return mode
+        return None
+    
+    @staticmethod
+    def get_archive_format(archive_path: str) -> Optional[str]:
+        """判断归档格式，返回'zip'、'tar'，无法识别返回None"""
+        if archive_path.lower().endswith('.zip'):
+            return 'zip'
+        if GeoProcessor.get_tar_write_mode(archive_path) is not None:
+            return 'tar'
+        if tarfile.is_tarfile(archive_path):
+            return 'tar'
+        if zipfile.is_zipfile(archive_path):
+            return 'zip'
+        return None
+    
+    @staticmethod
+    def get_archive_output_path(archive_path: str) -> str:
+        """生成归档的默认输出路径，在文件名后添加"_geo"后缀"""
+        dirname, basename = os.path.split(archive_path)
+        lower_name = basename.lower()
+        ext = os.path.splitext(basename)[1]
+        for tar_ext, _ in TAR_WRITE_MODES:
+            if lower_name.endswith(tar_ext):
+                ext = basename[-len(tar_ext):]
+                break
+        name = basename[:len(basename) - len(ext)]
+        return os.path.join(dirname, f"{name}_geo{ext}")
+    
+    @staticmethod
+    def strip_zip64_extra(extra: bytes) -> bytes:
+        """从ZIP扩展字段中移除ZIP64字段，其中的偏移量在新归档中已失效"""
+        result = b''
+        pos = 0
+        while pos + 4 <= len(extra):
+            header_id, size = struct.unpack('<HH', extra[pos:pos + 4])
+            if header_id != ZIP64_EXTRA_ID:
+                result += extra[pos:pos + 4 + size]
+            pos += 4 + size
+        return result + extra[pos:]
+    
+    @staticmethod
+    def copy_zip_member_raw(zin: zipfile.ZipFile, zout: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+        """将ZIP成员原样复制到新归档，不解压也不重新压缩
+        
+        本地文件头（含其自身的扩展字段）、压缩数据和数据描述符按原始字节复制，
+        因此加密成员的密码校验字节和ZIP64大小字段都保持不变。
+        
+        zipfile没有提供原样复制成员的公开接口，这里直接读写了ZipFile.fp、
+        start_dir、filelist、NameToInfo和_didModify等内部状态。
+        已在CPython 3.13上验证，升级Python版本时需要重新检查。
+        """
+        src = zin.fp
+        dst = zout.fp
+        
+        def copy_bytes(size: int) -> bytes:
+            """从源归档复制指定长度的数据，返回最后一块数据"""
+            chunk = b''
+            while size > 0:
+                chunk = src.read(min(COPY_CHUNK_SIZE, size))
+                if not chunk:
+                    raise zipfile.BadZipFile(f"Truncated member data: {info.filename}")
+                dst.write(chunk)
+                size -= len(chunk)
+            return chunk
+        
+        # 读取源归档中的本地文件头
+        src.seek(info.header_offset)
+        header = src.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad local file header: {info.filename}")
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        name_length = fields[ZIP_LOCAL_HEADER_NAME_LENGTH]
+        extra_length = fields[ZIP_LOCAL_HEADER_EXTRA_LENGTH]
+        name_and_extra = src.read(name_length + extra_length)
+        local_extra = name_and_extra[name_length:]
+        
+        new_info = copy.copy(info)
+        new_info.extra = GeoProcessor.strip_zip64_extra(info.extra)
+        dst.seek(zout.start_dir)
+        new_info.header_offset = dst.tell()
+        dst.write(header)
+        dst.write(name_and_extra)
+        copy_bytes(info.compress_size)
+        
+        # 数据描述符：可选的签名 + CRC + 压缩前后大小（ZIP64时大小为8字节）
+        if info.flag_bits & ZIP_FLAG_DATA_DESCRIPTOR:
+            is_zip64 = GeoProcessor.strip_zip64_extra(local_extra) != local_extra
+            remaining = 16 if is_zip64 else 8
+            if copy_bytes(4) == ZIP_DATA_DESCRIPTOR_SIGNATURE:
+                # 签名之后才是CRC
+                remaining += 4
+            copy_bytes(remaining)
+        
+        zout.filelist.append(new_info)
+        zout.NameToInfo[new_info.filename] = new_info
+        zout.start_dir = dst.tell()
+        zout._didModify = True
+    
+    @staticmethod
+    def process_zip_archive(archive_path: str, output_path: str, lat: float, lon: float) -> dict:
+        """流式处理ZIP归档：图片成员写入GPS信息，其余成员原样复制"""
+        stats = {'processed': 0, 'failed': 0, 'copied': 0}
+        with zipfile.ZipFile(archive_path, 'r') as zin, zipfile.ZipFile(output_path, 'w') as zout:
+            zout.comment = zin.comment
+            for info in zin.infolist():
+                if info.is_dir() or info.flag_bits & ZIP_FLAG_ENCRYPTED or not GeoProcessor.is_image_member(info.filename):
+                    GeoProcessor.copy_zip_member_raw(zin, zout, info)
+                    stats['copied'] += 1
+                    continue
+                
+                # 读取失败（如Deflate64成员或CRC错误）时与写入失败一样原样复制，不中断整个任务
+                try:
+                    data = GeoProcessor.add_gps_to_bytes(zin.read(info), lat, lon)
+                except Exception as read_error:
+                    print(f"Failed to read archive member: {info.filename}: {read_error}")
+                    data = None
+                if data is None:
+                    print(f"Failed to add GPS to archive member, copying original: {info.filename}")
+                    GeoProcessor.copy_zip_member_raw(zin, zout, info)
+                    stats['failed'] += 1
+                    continue
+                
+                # 保留原成员的压缩方式、时间和属性
+                new_info = zipfile.ZipInfo(info.filename, info.date_time)
+                new_info.compress_type = info.compress_type
+                new_info.external_attr = info.external_attr
+                new_info.create_system = info.create_system
+                new_info.comment = info.comment
+                new_info.extra = GeoProcessor.strip_zip64_extra(info.extra)
+                zout.writestr(new_info, data)
+                stats['processed'] += 1
+        return stats
+    
+    @staticmethod
+    def process_tar_archive(archive_path: str, output_path: str, write_mode: str, lat: float, lon: float) -> dict:
+        """流式处理TAR归档：顺序读取每个成员并写入新归档，只需一次读和一次写
+        
+        输入以管道模式打开，不会回退定位，压缩的TAR也不会重新解压。
+        写入GPS失败的图片直接使用已读入内存的原始数据写回，
+        成员本身读取失败时数据流已无法继续，直接中止任务。
+        """
+        stats = {'processed': 0, 'failed': 0, 'copied': 0}
+        with tarfile.open(archive_path, 'r|*') as tin, tarfile.open(output_path, write_mode) as tout:
+            for member in tin:
+                if not member.isfile() or not GeoProcessor.is_image_member(member.name):
+                    tout.addfile(member, tin.extractfile(member) if member.isfile() else None)
+                    stats['copied'] += 1
+                    continue
+                
+                raw = tin.extractfile(member).read()
+                data = GeoProcessor.add_gps_to_bytes(raw, lat, lon)
+                if data is None:
+                    print(f"Failed to add GPS to archive member, copying original: {member.name}")
+                    tout.addfile(member, io.BytesIO(raw))
+                    stats['failed'] += 1
+                    continue
+                
+                # PAX头中的size会覆盖新的成员大小，需要移除
+                new_member = copy.copy(member)
+                new_member.pax_headers = {key: value for key, value in member.pax_headers.items() if key != 'size'}
+                new_member.size = len(data)
+                tout.addfile(new_member, io.BytesIO(data))
+                stats['processed'] += 1
+        return stats
+    
+    @staticmethod
+    def process_archive(archive_path: str, lat: float, lon: float, output_path: Optional[str] = None, overwrite: bool = False) -> Optional[dict]:
+        """流式处理ZIP/TAR归档中的图片，无需先解压再重新打包
+        
+        Args:
+            archive_path: 输入归档路径
+            lat: 纬度
+            lon: 经度
+            output_path: 输出归档路径，如果为None则根据overwrite参数决定
+            overwrite: 是否覆盖原归档，默认为False
+        
+        Returns:
+            Optional[dict]: 成功返回包含output_path及processed/failed/copied数量的字典，失败返回None
+        """
+        if not archive_path:
+            print("Error: archive_path is None")
+            return None
+        
+        temp_path = None
+        try:
+            lat = float(lat)
+            lon = float(lon)
+            
+            if output_path is None:
+                output_path = archive_path if overwrite else GeoProcessor.get_archive_output_path(archive_path)
+            
+            # 先写入同目录下的临时文件，完成后再替换，避免中途失败损坏目标文件
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(output_path)))
+            os.close(fd)
+            
+            # 优先按扩展名判断格式：以ZIP成员结尾的TAR也能通过is_zipfile检测，
+            # 只有扩展名未知时才检测文件内容，并且先尝试TAR再尝试ZIP
+            archive_format = GeoProcessor.get_archive_format(archive_path)
+            # TAR的压缩方式由输出路径决定，输出扩展名未知时沿用输入的压缩方式
+            tar_mode = GeoProcessor.get_tar_write_mode(output_path) or GeoProcessor.get_tar_write_mode(archive_path)
+            if archive_format == 'zip':
+                stats = GeoProcessor.process_zip_archive(archive_path, temp_path, lat, lon)
+            elif archive_format == 'tar':
+                stats = GeoProcessor.process_tar_archive(archive_path, temp_path, tar_mode or 'w|', lat, lon)
+            else:
+                print(f"Unsupported archive format: {archive_path}")
+                return None
+            
+            shutil.copymode(archive_path, temp_path)
+            os.replace(temp_path, output_path)
+            temp_path = None
+            
+            print(f"Successfully processed archive: {output_path} "
+                  f"(processed={stats['processed']}, failed={stats['failed']}, copied={stats['copied']})")
+            return {'output_path': output_path, **stats}
+        except Exception as e:
+            print(f"Failed to process archive: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -4,6 +4,10 @@ import os
 from dotenv import load_dotenv
 load_dotenv()  # 加载.env文件中的环境变量
 
+# 文件选择对话框的文件类型过滤
+IMAGE_FILE_TYPES = ('Image Files (*.jpg;*.jpeg;*.avif;*.heic;*.heif)', )
+ARCHIVE_FILE_TYPES = ('Archive Files (*.zip;*.tar;*.gz;*.tgz;*.bz2;*.tbz2;*.xz;*.txz)', )
+
 class Api:
     """提供给前端调用的API类"""
     
@@ -29,8 +33,8 @@ class Api:
                 'error': str(e)
             }
     
-    def _select_files(self, allow_multiple=False):
-        """打开文件选择对话框，选择图片文件"""
+    def _select_files(self, allow_multiple=False, file_types=IMAGE_FILE_TYPES):
+        """打开文件选择对话框，选择指定类型的文件"""
         try:
             import webview
             
@@ -40,7 +44,7 @@ class Api:
             # 打开文件选择对话框 - pywebview 6.0 API
             file_paths = window.create_file_dialog(
                 webview.FileDialog.OPEN,
-                file_types=('Image Files (*.jpg;*.jpeg;*.avif;*.heic;*.heif)', ),
+                file_types=file_types,
                 allow_multiple=allow_multiple
             )
             
@@ -70,6 +74,10 @@ class Api:
         """打开文件选择对话框，选择多个图片文件"""
         return self._select_files(allow_multiple=True)
     
+    def select_archive(self):
+        """打开文件选择对话框，选择ZIP/TAR归档文件"""
+        return self._select_files(allow_multiple=False, file_types=ARCHIVE_FILE_TYPES)
+    
     def get_image_data(self, file_path):
         """读取图片数据并转换为base64格式"""
         try:
@@ -150,6 +158,31 @@ class Api:
                 'error': str(e)
             }
     
+    def process_archive(self, archive_path, latitude, longitude, overwrite=False):
+        """流式处理ZIP/TAR归档中的图片，添加GPS信息"""
+        try:
+            # 调用GeoProcessor流式处理归档，无需解压再重新打包
+            result = GeoProcessor.process_archive(archive_path, latitude, longitude, overwrite=overwrite)
+            
+            if result:
+                return {
+                    'success': True,
+                    'output_path': result['output_path'],
+                    'processed': result['processed'],
+                    'failed': result['failed'],
+                    'copied': result['copied']
+                }
+            else:
+                return {
+                    'success': False,
+                    'error': '处理归档失败'
+                }
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
     def search_address(self, address):
         """调用地址查询API获取经纬度"""
         try:
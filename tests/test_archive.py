@@ -0,0 +1,249 @@
+"""归档模式的回归测试：处理后的归档必须能通过unzip -t / tarfile校验，且图片包含GPS信息"""
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+from PIL import Image
+
+from geo_picture import GeoProcessor
+
+LAT = 31.2304
+LON = -121.4737
+
+
+def make_jpeg() -> bytes:
+    """生成一张不含EXIF的JPEG图片"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'red').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class NonSeekableWriter(io.RawIOBase):
+    """不可定位的输出流，使zipfile写入数据描述符"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.fileobj.write(data)
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.jpeg = make_jpeg()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir, name)
+
+    def assert_has_gps(self, data: bytes):
+        """将图片数据写入临时文件，用get_gps_info校验经纬度"""
+        image_path = self.path('check.jpg')
+        with open(image_path, 'wb') as f:
+            f.write(data)
+        gps = GeoProcessor.get_gps_info(image_path)
+        self.assertIsNotNone(gps)
+        self.assertAlmostEqual(gps[0], LAT, places=4)
+        self.assertAlmostEqual(gps[1], LON, places=4)
+
+    def assert_unzip_ok(self, archive_path: str, password: str = None):
+        """使用unzip -t校验ZIP归档（未安装unzip时跳过）"""
+        if shutil.which('unzip') is None:
+            return
+        command = ['unzip', '-t']
+        if password:
+            command += ['-P', password]
+        result = subprocess.run(command + [archive_path], capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+
+    def process(self, archive_name: str, **kwargs) -> dict:
+        result = GeoProcessor.process_archive(self.path(archive_name), LAT, LON, **kwargs)
+        self.assertIsNotNone(result)
+        return result
+
+    def test_zip(self):
+        with zipfile.ZipFile(self.path('shoot.zip'), 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('photos/a.jpg', self.jpeg)
+            z.writestr('notes.txt', 'hello' * 100)
+            z.mkdir('empty')
+
+        result = self.process('shoot.zip')
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (1, 0, 2))
+        self.assert_unzip_ok(result['output_path'])
+        with zipfile.ZipFile(result['output_path']) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.namelist(), ['photos/a.jpg', 'notes.txt', 'empty/'])
+            self.assertEqual(z.read('notes.txt'), b'hello' * 100)
+            self.assert_has_gps(z.read('photos/a.jpg'))
+
+    def test_streamed_zip(self):
+        # 不可定位的输出流会为每个成员写入数据描述符，force_zip64时为ZIP64格式
+        with open(self.path('stream.zip'), 'wb') as f:
+            with zipfile.ZipFile(NonSeekableWriter(f), 'w', zipfile.ZIP_DEFLATED) as z:
+                with z.open('a.jpg', 'w') as member:
+                    member.write(self.jpeg)
+                with z.open('notes.txt', 'w') as member:
+                    member.write(b'notes' * 100)
+                with z.open('big.txt', 'w', force_zip64=True) as member:
+                    member.write(b'data' * 100)
+
+        result = self.process('stream.zip')
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (1, 0, 2))
+        self.assert_unzip_ok(result['output_path'])
+        with zipfile.ZipFile(result['output_path']) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.read('notes.txt'), b'notes' * 100)
+            self.assertEqual(z.read('big.txt'), b'data' * 100)
+            self.assert_has_gps(z.read('a.jpg'))
+
+    @unittest.skipIf(shutil.which('zip') is None, 'zip command not available')
+    def test_encrypted_zip(self):
+        # 加密成员无法写入GPS信息，必须原样复制且密码仍然有效
+        with open(self.path('a.jpg'), 'wb') as f:
+            f.write(self.jpeg)
+        with open(self.path('notes.txt'), 'w') as f:
+            f.write('secret' * 100)
+        subprocess.run(['zip', '-q', '-P', 'pw', 'enc.zip', 'a.jpg', 'notes.txt'], cwd=self.tmpdir, check=True)
+
+        result = self.process('enc.zip')
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (0, 0, 2))
+        self.assert_unzip_ok(result['output_path'], password='pw')
+        with zipfile.ZipFile(result['output_path']) as z:
+            z.setpassword(b'pw')
+            self.assertIsNone(z.testzip())
+            self.assertEqual(z.read('notes.txt'), b'secret' * 100)
+            self.assertEqual(z.read('a.jpg'), self.jpeg)
+
+    def test_corrupt_zip_member_is_copied(self):
+        with zipfile.ZipFile(self.path('crc.zip'), 'w') as z:
+            z.writestr('bad.jpg', self.jpeg)
+        with open(self.path('crc.zip'), 'rb') as f:
+            data = bytearray(f.read())
+        start = data.find(self.jpeg)
+        data[start + 200] ^= 0xff
+        corrupted = bytes(data[start:start + len(self.jpeg)])
+        with open(self.path('crc.zip'), 'wb') as f:
+            f.write(data)
+
+        # CRC错误的成员计为失败并原样复制，不中断整个任务
+        result = self.process('crc.zip')
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (0, 1, 0))
+        with open(result['output_path'], 'rb') as f:
+            self.assertIn(corrupted, f.read())
+
+    def write_tar(self, name: str, mode: str, members, **kwargs):
+        with tarfile.open(self.path(name), mode, **kwargs) as t:
+            for member_name, data in members:
+                info = tarfile.TarInfo(member_name)
+                info.size = len(data)
+                t.addfile(info, io.BytesIO(data))
+
+    def assert_tar_ok(self, archive_path: str, expected_names):
+        with tarfile.open(archive_path) as t:
+            self.assertEqual(t.getnames(), expected_names)
+            for member in t:
+                self.assertEqual(len(t.extractfile(member).read()), member.size)
+            return {member.name: t.extractfile(member).read() for member in t}
+
+    def test_tar(self):
+        self.write_tar('shoot.tar', 'w', [('a.jpg', self.jpeg), ('notes.txt', b'hi')])
+
+        result = self.process('shoot.tar')
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (1, 0, 1))
+        members = self.assert_tar_ok(result['output_path'], ['a.jpg', 'notes.txt'])
+        self.assertEqual(members['notes.txt'], b'hi')
+        self.assert_has_gps(members['a.jpg'])
+
+    def test_tar_gz(self):
+        self.write_tar('shoot.tar.gz', 'w:gz', [('a.jpg', self.jpeg), ('junk.jpg', b'not an image')])
+
+        result = self.process('shoot.tar.gz')
+        self.assertTrue(result['output_path'].endswith('shoot_geo.tar.gz'))
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (1, 1, 0))
+        with open(result['output_path'], 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+        members = self.assert_tar_ok(result['output_path'], ['a.jpg', 'junk.jpg'])
+        self.assertEqual(members['junk.jpg'], b'not an image')
+        self.assert_has_gps(members['a.jpg'])
+
+    def test_tar_gz_large_failed_member(self):
+        # 超出读缓冲区的失败成员必须使用已读入的数据写回，不能回退定位导致重新解压
+        junk = os.urandom(1024 * 1024)
+        self.write_tar('big.tar.gz', 'w:gz', [('junk.jpg', junk), ('a.jpg', self.jpeg), ('notes.txt', b'hi')])
+
+        written = {}
+        original_addfile = tarfile.TarFile.addfile
+
+        def record_addfile(tar, tarinfo, fileobj=None):
+            written[tarinfo.name] = fileobj
+            return original_addfile(tar, tarinfo, fileobj)
+
+        with mock.patch.object(tarfile.TarFile, 'addfile', record_addfile):
+            result = self.process('big.tar.gz')
+
+        self.assertEqual((result['processed'], result['failed'], result['copied']), (1, 1, 1))
+        self.assertIsInstance(written['junk.jpg'], io.BytesIO)
+        self.assertEqual(written['junk.jpg'].getvalue(), junk)
+        members = self.assert_tar_ok(result['output_path'], ['junk.jpg', 'a.jpg', 'notes.txt'])
+        self.assertEqual(members['junk.jpg'], junk)
+        self.assertEqual(members['notes.txt'], b'hi')
+        self.assert_has_gps(members['a.jpg'])
+
+    def test_tar_output_compression_follows_output_path(self):
+        self.write_tar('shoot.tar.gz', 'w:gz', [('a.jpg', self.jpeg)])
+
+        result = self.process('shoot.tar.gz', output_path=self.path('plain.tar'))
+        with tarfile.open(result['output_path'], 'r:') as t:
+            self.assertEqual(t.getnames(), ['a.jpg'])
+
+    def test_tar_pax_size_is_dropped(self):
+        # 源PAX头中的size会覆盖写入GPS后的新大小，导致后续成员错位
+        with tarfile.open(self.path('pax.tar'), 'w', format=tarfile.PAX_FORMAT) as t:
+            for member_name, data in [('a.jpg', self.jpeg), ('notes.txt', b'hi')]:
+                info = tarfile.TarInfo(member_name)
+                info.size = len(data)
+                info.pax_headers = {'size': str(len(data))}
+                t.addfile(info, io.BytesIO(data))
+
+        result = self.process('pax.tar')
+        members = self.assert_tar_ok(result['output_path'], ['a.jpg', 'notes.txt'])
+        self.assertEqual(members['notes.txt'], b'hi')
+        self.assertGreater(len(members['a.jpg']), len(self.jpeg))
+        self.assert_has_gps(members['a.jpg'])
+
+    def test_tar_ending_with_zip_member(self):
+        # 最后一个成员是ZIP的TAR也能通过is_zipfile检测，必须按扩展名识别为TAR
+        inner = io.BytesIO()
+        with zipfile.ZipFile(inner, 'w') as z:
+            z.writestr('x.txt', 'x')
+        self.write_tar('shoot.tar', 'w', [('a.jpg', self.jpeg), ('inner.zip', inner.getvalue())])
+
+        result = self.process('shoot.tar')
+        members = self.assert_tar_ok(result['output_path'], ['a.jpg', 'inner.zip'])
+        self.assertEqual(members['inner.zip'], inner.getvalue())
+        self.assert_has_gps(members['a.jpg'])
+
+    def test_overwrite(self):
+        self.write_tar('shoot.tar', 'w', [('a.jpg', self.jpeg)])
+
+        result = self.process('shoot.tar', overwrite=True)
+        self.assertEqual(result['output_path'], self.path('shoot.tar'))
+        members = self.assert_tar_ok(self.path('shoot.tar'), ['a.jpg'])
+        self.assert_has_gps(members['a.jpg'])
+
+
+if __name__ == '__main__':
+    unittest.main()